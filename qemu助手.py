@@ -15,12 +15,16 @@ Date: 2025-12-27
 # ==============================================================================
 import os
 import sys
-import glob
 import json
+import mmap
+import functools
+import hashlib
+import itertools
 import time
 import shutil
 import readline
 import subprocess
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict, Optional, Tuple, Any
 
 # --- Constants ---
@@ -62,6 +66,56 @@ class Colors:
     BOLD = '\033[1m'
     UNDERLINE = '\033[4m'
 
+# --- Static menu blocks (built once at import; rendered with one write) ---
+DISK_MENU = (
+    "-" * 40 + "\n"
+    "  [A] 添加新磁盘 (Add/Create)\n"
+    "  [I] 导入磁盘 (Import)\n"
+    "  [T] 设为启动盘 (Set Boot Disk)\n"
+    "  [S] 快照管理 (Snapshots)\n"
+    "  [D] 卸载磁盘 (Detach)\n"
+    "  [F] 文件清理 (File Manager)\n"
+    "  [B] 返回 (Back)\n"
+)
+
+CDROM_MENU = (
+    "-" * 40 + "\n"
+    "  [I] 导入 ISO 文件 (Import ISO)\n"
+    "  [D] 弹出/移除 ISO (Detach)\n"
+    "  [F] 文件清理 (File Manager)\n"
+    "  [B] 返回 (Back)\n"
+)
+
+MOUNTS_MENU = (
+    "-" * 40 + "\n"
+    "  [I] 导入文件到默认共享目录 (Import to Default)\n"
+    "  [F] 管理默认共享目录文件 (File Manager)\n"
+    "  [A] 添加临时挂载 (Add Transient Mount)\n"
+    "  [C] 清空临时挂载 (Clear Transient)\n"
+    "  [O] 打开默认共享目录 (Open Default Folder)\n"
+    "  [B] 返回 (Back)\n"
+)
+
+SESSION_MENU = (
+    "-" * 52 + "\n"
+    "  [S] 启动虚拟机 (Start)\n"
+    "  [H] CPU和内存配置 (CPU/Mem)\n"
+    "  [I] 输入配置 (Input)\n"
+    "  [D] 磁盘管理 (Disks)\n"
+    "  [C] 光驱管理 (CD/ISO)\n"
+    "  [M] 更多挂载 (Mounts)\n"
+    "  [X] 删除会话 (Delete Session)\n"
+    "  [B] 返回主菜单 (Back)\n"
+    + "-" * 52 + "\n"
+)
+
+MAIN_MENU = (
+    "-" * 52 + "\n"
+    "  [N] 新建会话 (New Session)\n"
+    "  [Q] 退出 (Quit)\n"
+    + "-" * 52 + "\n"
+)
+
 class UI:
     """Static utility class for User Interface operations."""
 
@@ -83,36 +137,47 @@ class UI:
         Gets user input with a default value pre-filled in the prompt.
         Uses readline to allow editing the default value.
         """
+        full_prompt = f"{prompt}: "
+
+        # No default: plain input, no hook closure or readline state to touch.
+        if not default:
+            return input(full_prompt).strip()
+
         def hook():
             readline.insert_text(default)
             readline.redisplay()
-        
-        if default:
-            readline.set_pre_input_hook(hook)
-        
+
+        readline.set_pre_input_hook(hook)
         try:
-            user_input = input(f"{prompt}: ").strip()
+            user_input = input(full_prompt).strip()
         finally:
             readline.set_pre_input_hook(None)
-            
+
         return user_input if user_input else default
 
+    # Match list for the current completion cycle; readline restarts every
+    # cycle at state 0, so the directory is scanned once per TAB, not once
+    # per candidate — and never served stale across prompts.
+    _completion_matches: List[str] = []
+
     @staticmethod
     def path_completer(text: str, state: int) -> Optional[str]:
         """Readline completer for file paths."""
-        text = os.path.expanduser(text)
-        matches = glob.glob(text + '*')
-        matches.sort()
-        
-        results: List[str] = []
-        for m in matches:
-            if os.path.isdir(m):
-                results.append(m + "/")
-            else:
-                results.append(m)
-                
-        if state < len(results):
-            return results[state]
+        if state == 0:
+            expanded = os.path.expanduser(text)
+            dirname, base = os.path.split(expanded)
+            try:
+                # entry.is_dir() reuses the d_type from readdir: no extra stat.
+                with os.scandir(dirname or '.') as it:
+                    UI._completion_matches = sorted(
+                        os.path.join(dirname, e.name) + ("/" if e.is_dir(follow_symlinks=False) else "")
+                        for e in it if e.name.startswith(base)
+                    )
+            except OSError:
+                UI._completion_matches = []
+
+        if state < len(UI._completion_matches):
+            return UI._completion_matches[state]
         else:
             return None
 
@@ -134,67 +199,190 @@ class FS:
         readline.set_completer_delims(' \t\n;')
 
     @staticmethod
+    @functools.lru_cache(maxsize=1)
     def detect_ovmf() -> Tuple[Optional[str], Optional[str]]:
-        """Detects OVMF firmware and VARS template paths."""
+        """Detects OVMF firmware and VARS template paths (cached per process)."""
+        # Scan each candidate directory once instead of stat-ing every path.
+        dir_entries: Dict[str, set] = {}
         code_path = None
         for path in OVMF_CODE_PATHS:
-            if os.path.exists(path):
+            d = os.path.dirname(path)
+            if d not in dir_entries:
+                try:
+                    dir_entries[d] = {e.name for e in os.scandir(d)}
+                except OSError:
+                    dir_entries[d] = set()
+            if os.path.basename(path) in dir_entries[d]:
                 code_path = path
                 break
-        
+
         if not code_path:
             return None, None
 
+        # Reuse the already-scanned entry set for the chosen directory.
         ovmf_dir = os.path.dirname(code_path)
         vars_path = None
         for candidate in OVMF_VARS_CANDIDATES:
-            p = os.path.join(ovmf_dir, candidate)
-            if os.path.exists(p):
-                vars_path = p
+            if candidate in dir_entries[ovmf_dir]:
+                vars_path = os.path.join(ovmf_dir, candidate)
                 break
-                
+
         return code_path, vars_path
 
 # ==============================================================================
 # MODULE: CORE LOGIC (QEMU RUNNER)
 # ==============================================================================
 
+# --- Capability probes (detected once, cached at module level) ---
+_AIO_BACKEND: Optional[str] = None
+
+def detect_aio_backend() -> str:
+    """Detects the best available QEMU AIO backend ("io_uring" or "native")."""
+    global _AIO_BACKEND
+    if _AIO_BACKEND is None:
+        try:
+            res = subprocess.run(["qemu-system-x86_64", "-drive", "help"],
+                                 capture_output=True, text=True)
+            output = (res.stdout or "") + (res.stderr or "")
+            _AIO_BACKEND = "io_uring" if "io_uring" in output else "native"
+        except Exception:
+            _AIO_BACKEND = "native"
+    return _AIO_BACKEND
+
+_PACKED_VIRTQUEUE: Optional[bool] = None
+
+def detect_packed_virtqueue() -> bool:
+    """True if QEMU supports packed virtqueues (>= 4.2, cached per process)."""
+    global _PACKED_VIRTQUEUE
+    if _PACKED_VIRTQUEUE is None:
+        _PACKED_VIRTQUEUE = False
+        try:
+            res = subprocess.run(["qemu-system-x86_64", "--version"],
+                                 capture_output=True, text=True)
+            # e.g. "QEMU emulator version 8.2.2 (...)"
+            for token in res.stdout.split():
+                if token[:1].isdigit():
+                    major, minor = (token.split(".") + ["0"])[:2]
+                    _PACKED_VIRTQUEUE = (int(major), int(minor)) >= (4, 2)
+                    break
+        except Exception:
+            pass
+    return _PACKED_VIRTQUEUE
+
+_HUGEPAGES_FREE_BYTES: Optional[int] = None
+
+def detect_hugepages() -> int:
+    """Free hugepage capacity in bytes from /proc/meminfo (cached per process)."""
+    global _HUGEPAGES_FREE_BYTES
+    if _HUGEPAGES_FREE_BYTES is None:
+        _HUGEPAGES_FREE_BYTES = 0
+        free = size_kb = 0
+        try:
+            with open("/proc/meminfo") as f:
+                for line in f:
+                    if line.startswith("HugePages_Free:"):
+                        free = int(line.split()[1])
+                    elif line.startswith("Hugepagesize:"):
+                        size_kb = int(line.split()[1])
+            _HUGEPAGES_FREE_BYTES = free * size_kb * 1024
+        except (OSError, ValueError, IndexError):
+            pass
+    return _HUGEPAGES_FREE_BYTES
+
+def parse_mem_size(mem_size: str) -> int:
+    """Parses a QEMU -m size ("4G", "512M", bare MiB) into bytes; 0 if unparsable."""
+    try:
+        suffix = mem_size[-1:].upper()
+        if suffix == "G":
+            return int(mem_size[:-1]) * 1024 ** 3
+        if suffix == "M":
+            return int(mem_size[:-1]) * 1024 ** 2
+        return int(mem_size) * 1024 ** 2  # bare numbers are MiB to qemu -m
+    except ValueError:
+        return 0
+
 class QEMURunner:
     """Handles the construction and execution of the QEMU command."""
 
+    # Config-independent (option, value) pairs, shared by all runners.
+    _STATIC_ARGS: Tuple[Tuple[str, str], ...] = (
+        ("-accel", "kvm"),
+        ("-boot", "menu=on"),
+        ("-cpu", "host,hv_relaxed,hv_spinlocks=0x1fff,hv_vapic,hv_time,hv_synic,hv_stimer,hv_reset,hv_vpindex,hv_runtime,hv_frequencies"),
+        # VirtIO Devices (base)
+        ("-device", "virtio-balloon-pci"),
+        ("-device", "virtio-rng-pci"),
+        ("-device", "virtio-serial-pci"),
+        # USB controller (present if USB devices needed)
+        ("-device", "qemu-xhci,id=usb"),
+        # Graphics & Audio
+        ("-device", "virtio-vga-gl"), ("-display", "gtk,gl=on,zoom-to-fit=on,grab-on-hover=on"),
+        ("-device", "intel-hda"), ("-device", "hda-duplex"),
+    )
+
     def __init__(self, session: 'Session', ovmf_code: str):
         self.session = session
         self.ovmf_code = ovmf_code
 
-    def build_command(self) -> List[str]:
-        """Constructs the QEMU command line arguments."""
-        config = self.session.config
-        
-        cmd = [
-            "qemu-system-x86_64",
-            "-name", config.get("VM_NAME", "unknown"),
-            "-machine", "q35", "-accel", "kvm",
-            "-boot", "menu=on",
-            # Performance Optimizations
-            "-object", "iothread,id=io0",
-            "-cpu", "host,hv_relaxed,hv_spinlocks=0x1fff,hv_vapic,hv_time,hv_synic,hv_stimer,hv_reset,hv_vpindex,hv_runtime,hv_frequencies",
-            "-m", config.get("MEM_SIZE", "4G"),
-            "-smp", config.get("CPU_CORES", "2"),
+        config = session.config
+        aio = detect_aio_backend()
+
+        try:
+            smp = int(config.get("CPU_CORES", "2"))
+        except ValueError:
+            smp = 2
+        self.smp = max(1, smp)
+        self.num_iothreads = min(self.smp, 4)
+        # Packed ring layout (virtio 1.1): 1 descriptor indirection vs 3.
+        self.vq_opts = ",packed=on,event_idx=on,indirect_desc=on" if detect_packed_virtqueue() else ""
+
+        # Static prefix: everything that doesn't depend on attached resources.
+        # Guest RAM: memfd backend, preallocated; hugepages when the host has
+        # enough free to cover the whole guest — prealloc=on makes QEMU abort
+        # at startup on a partial pool, so presence alone isn't enough.
+        mem_size = config.get("MEM_SIZE", "4G")
+        mem_bytes = parse_mem_size(mem_size)
+        hugetlb = "hugetlb=on," if 0 < mem_bytes <= detect_hugepages() else ""
+
+        # Network: userspace SLIRP by default (works unprivileged, NAT out of
+        # the box). NET_MODE=tap opts into tap + vhost-net — packet copies
+        # stay in the kernel — but needs CAP_NET_ADMIN and the caller to
+        # bridge/configure the interface. The offload flags let the host hand
+        # the guest GSO superpackets instead of MTU-sized fragments.
+        offloads = "mrg_rxbuf=on,ctrl_vq=on,guest_csum=on,guest_tso4=on,guest_tso6=on,guest_ufo=on"
+        if config.get("NET_MODE", "user") == "tap":
+            netdev = f"tap,id=net0,vhost=on,vhostforce=on,queues={self.smp},script=no,downscript=no,ifname=qemu%d"
+        else:
+            netdev = "user,id=net0"
+
+        prefix_pairs: Tuple[Tuple[str, str], ...] = (
+            ("-name", config.get("VM_NAME", "unknown")),
+            ("-machine", "q35,memory-backend=mem0"),
+            *self._STATIC_ARGS,
+            ("-object", f"memory-backend-memfd,id=mem0,size={mem_size},{hugetlb}prealloc=on,prealloc-threads=4"),
+            ("-m", mem_size),
+            ("-smp", config.get("CPU_CORES", "2")),
             # Firmware
-            "-drive", f"if=pflash,format=raw,readonly=on,file={self.ovmf_code}",
-            "-drive", f"if=pflash,format=raw,file={self.session.vars_file}",
-            # VirtIO Devices (base)
-            "-device", "virtio-balloon-pci",
-            "-device", "virtio-rng-pci",
-            "-device", "virtio-serial-pci",
-            # USB controller (present if USB devices needed)
-            "-device", "qemu-xhci,id=usb",
-            # Graphics & Audio
-            "-device", "virtio-vga-gl", "-display", "gtk,gl=on,zoom-to-fit=on,grab-on-hover=on",
-            "-device", "intel-hda", "-device", "hda-duplex",
+            ("-drive", f"if=pflash,format=raw,readonly=on,cache=none,aio={aio},file={self.ovmf_code}"),
+            ("-drive", f"if=pflash,format=raw,file={self.session.vars_file}"),
             # Network
-            "-device", "virtio-net-pci,netdev=net0,mq=on", "-netdev", "user,id=net0"
-        ]
+            ("-device", f"virtio-net-pci,netdev=net0,mq=on,vectors={2 * self.smp + 2},{offloads}{self.vq_opts}"), ("-netdev", netdev),
+            # Performance Optimizations: one iothread per virtqueue (capped at 4)
+            *(("-object", f"iothread,id=io{k}") for k in range(self.num_iothreads)),
+        )
+        self._static_prefix: List[str] = ["qemu-system-x86_64"]
+        self._static_prefix.extend(arg for pair in prefix_pairs for arg in pair)
+
+    def build_command(self) -> List[str]:
+        """Constructs the QEMU command line arguments."""
+        aio = detect_aio_backend()
+        smp = self.smp
+        num_iothreads = self.num_iothreads
+
+        cmd = list(self._static_prefix)
+
+        # Dynamic (option, value) pairs, flattened into cmd in one pass.
+        pairs: List[Tuple[str, str]] = []
 
         # Input devices: decide at runtime from session configuration
         try:
@@ -204,83 +392,112 @@ class QEMURunner:
 
         # Keyboard
         if kb_type == "ps2":
-            cmd.extend(["-device", "ps2-keyboard"])
+            pairs.append(("-device", "ps2-keyboard"))
         elif kb_type == "usb":
             # USB keyboard uses host controller
-            cmd.extend(["-device", "usb-kbd"])
+            pairs.append(("-device", "usb-kbd"))
         else:  # virtio
-            cmd.extend(["-device", "virtio-keyboard-pci"])
+            pairs.append(("-device", "virtio-keyboard-pci"))
 
         # Pointer / mouse
         if mouse_type == "ps2":
-            cmd.extend(["-device", "ps2-mouse"])
+            pairs.append(("-device", "ps2-mouse"))
         elif mouse_type == "usb":
-            cmd.extend(["-device", "usb-mouse"])
+            pairs.append(("-device", "usb-mouse"))
         elif mouse_type == "usb-tablet":
-            cmd.extend(["-device", "usb-tablet"])
+            pairs.append(("-device", "usb-tablet"))
         else:  # virtio-tablet
-            cmd.extend(["-device", "virtio-tablet-pci"])
+            pairs.append(("-device", "virtio-tablet-pci"))
 
         # Disks
         # ISOs get boot priority (1..N), Disks follow (N+1..M)
+        # One readdir per directory instead of a stat per attached file.
+        try:
+            existing_disks = set(os.listdir(self.session.disk_dir))
+        except OSError:
+            existing_disks = set()
+        try:
+            existing_isos = set(os.listdir(self.session.iso_dir))
+        except OSError:
+            existing_isos = set()
+
         iso_boot_offset = len(self.session.isos)
+        boot_disk = self.session.boot_disk
 
         for i, disk in enumerate(self.session.disks):
             disk_path = os.path.join(self.session.disk_dir, disk)
-            if os.path.exists(disk_path):
+            if disk in existing_disks:
                 drive_id = f"drive_disk_{i}"
-                serial = f"DISK_{i}"
-                cmd.extend([
-                    "-drive", f"file={disk_path},format=qcow2,if=none,id={drive_id},cache=writeback",
-                    "-device", f"virtio-blk-pci,drive={drive_id},serial={serial},bootindex={iso_boot_offset + i + 1},iothread=io0"
-                ])
+                # Serial derived from the filename, so guest /dev/disk/by-id
+                # paths stay stable when disks are added, removed or reordered.
+                serial = "D" + hashlib.sha1(disk.encode()).hexdigest()[:11].upper()
+                boot = f",bootindex={iso_boot_offset + 1}" if disk == boot_disk else ""
+                pairs.append(("-drive", f"file={disk_path},format=qcow2,if=none,id={drive_id},cache=none,aio={aio},discard=unmap,detect-zeroes=unmap"))
+                pairs.append(("-device", f"virtio-blk-pci,drive={drive_id},serial={serial}{boot},num-queues={smp},iothread=io{i % num_iothreads}{self.vq_opts}"))
             else:
                 print(f"{Colors.WARNING}⚠️  警告: 磁盘文件丢失: {disk}{Colors.ENDC}")
 
         # ISOs
         for i, iso in enumerate(self.session.isos):
             iso_path = os.path.join(self.session.iso_dir, iso)
-            if os.path.exists(iso_path):
+            if iso in existing_isos:
                 drive_id = f"drive_cd_{i}"
-                cmd.extend([
-                    "-drive", f"file={iso_path},format=raw,if=none,id={drive_id},media=cdrom,readonly=on",
-                    "-device", f"ide-cd,drive={drive_id},bootindex={i+1}"
-                ])
+                pairs.append(("-drive", f"file={iso_path},format=raw,if=none,id={drive_id},media=cdrom,readonly=on,cache=none,aio={aio}"))
+                pairs.append(("-device", f"ide-cd,drive={drive_id},bootindex={i+1}"))
             else:
                 print(f"{Colors.WARNING}⚠️  警告: ISO 文件丢失: {iso}{Colors.ENDC}")
 
-        # Extra Mounts (USB Storage)
-        # 1. Default Shared Folder
-        cmd.extend([
-            "-drive", f"file=fat:ro:{self.session.shared_dir},format=raw,if=none,id=drive_shared,readonly=on",
-            "-device", "usb-storage,drive=drive_shared,serial=SHARED_AUTO,removable=on"
-        ])
+        # Extra Mounts
+        # 1. Default Shared Folder (virtio-9p passthrough; guest mounts via
+        #    `mount -t 9p -o trans=virtio shared /mnt/...`)
+        pairs.append(("-virtfs", f"local,path={self.session.shared_dir},mount_tag=shared,security_model=mapped-xattr,readonly=on"))
+
+        # 2. Transient Mounts (directories via 9p, image files as USB storage)
+        # Classify paths with one scandir per parent directory, reading the
+        # file type from the cached d_type instead of two stats per path.
+        transient_kind: Dict[str, str] = {}
+        by_parent = sorted(self.session.transient_mounts, key=os.path.dirname)
+        for parent, group in itertools.groupby(by_parent, key=os.path.dirname):
+            wanted = {os.path.basename(p): p for p in group}
+            try:
+                with os.scandir(parent or '.') as it:
+                    for entry in it:
+                        if entry.name in wanted:
+                            if entry.is_dir():
+                                transient_kind[wanted[entry.name]] = "dir"
+                            elif entry.is_file():
+                                transient_kind[wanted[entry.name]] = "file"
+            except OSError:
+                pass
 
-        # 2. Transient Mounts
         for i, path in enumerate(self.session.transient_mounts):
             drive_id = f"drive_trans_{i}"
             serial = f"TRANS_{i}"
-            
-            if os.path.isdir(path):
-                cmd.extend([
-                    "-drive", f"file=fat:ro:{path},format=raw,if=none,id={drive_id},readonly=on",
-                    "-device", f"usb-storage,drive={drive_id},serial={serial},removable=on"
-                ])
-            elif os.path.isfile(path):
-                cmd.extend([
-                    "-drive", f"file={path},format=raw,if=none,id={drive_id},readonly=on",
-                    "-device", f"usb-storage,drive={drive_id},serial={serial},removable=on"
-                ])
+            kind = transient_kind.get(path)
+
+            if kind == "dir":
+                pairs.append(("-virtfs", f"local,path={path},mount_tag=trans{i},security_model=mapped-xattr,readonly=on"))
+            elif kind == "file":
+                pairs.append(("-drive", f"file={path},format=raw,if=none,id={drive_id},readonly=on"))
+                pairs.append(("-device", f"usb-storage,drive={drive_id},serial={serial},removable=on"))
             else:
                 print(f"{Colors.WARNING}>> 忽略无效路径: {path}{Colors.ENDC}")
 
+        cmd.extend(arg for pair in pairs for arg in pair)
+
+        # Every -drive must carry an explicit format=: autoprobing reads the
+        # image header per disk at startup and newer QEMU disallows it.
+        for opt, val in zip(cmd, cmd[1:]):
+            if opt == "-drive":
+                assert "format=" in val, f"-drive 缺少显式 format=: {val}"
+
         return cmd
 
     def run(self) -> None:
         """Executes the VM."""
         cmd = self.build_command()
         print(f"\n{Colors.GREEN}>> 虚拟机正在启动...{Colors.ENDC}")
-        print(f"{Colors.WARNING}⚠️  注意: 额外挂载的资源将显示为 USB 移动存储设备。{Colors.ENDC}")
+        print(f"{Colors.WARNING}⚠️  注意: 共享目录通过 virtio-9p 挂载 (客户机内: mount -t 9p -o trans=virtio <标签> /mnt/...)，镜像文件显示为 USB 移动存储设备。{Colors.ENDC}")
         # 格式化为多行shell命令，便于阅读和复制
         shell_lines: List[str] = []
         if cmd:
@@ -298,13 +515,14 @@ class QEMURunner:
             # 去掉最后一行的 \
             if shell_lines[-1].endswith(' \\'):
                 shell_lines[-1] = shell_lines[-1][:-2]
-        print(f"{Colors.BLUE}QEMU命令行 (可复制):{Colors.ENDC}\n" + '\n'.join(shell_lines) + '\n')
-        time.sleep(2)
-        
+        print(f"{Colors.BLUE}QEMU命令行 (可复制):{Colors.ENDC}\n" + '\n'.join(shell_lines) + '\n', flush=True)
+
         proc = None
         try:
-            # Start QEMU as a subprocess so we can report PID and inspect it
-            proc = subprocess.Popen(cmd)
+            # Start QEMU as a subprocess so we can report PID and inspect it.
+            # close_fds=False skips the O(RLIMIT_NOFILE) fd-closing scan; we
+            # can't exec in place because the session menu resumes afterwards.
+            proc = subprocess.Popen(cmd, close_fds=False)
             pid = proc.pid
             print(f"{Colors.GREEN}>> QEMU 已启动, PID={pid}{Colors.ENDC}")
 
@@ -360,6 +578,34 @@ class Session:
         self.isos: List[str] = []
         self.transient_mounts: List[str] = []
 
+        # stat() cache: path -> (parent dir mtime_ns, stat result or None)
+        self._stat_cache: Dict[str, Tuple[int, Optional[os.stat_result]]] = {}
+        # True when in-memory state differs from the file on disk
+        self._dirty = False
+        # qemu-img info cache: (path, mtime_ns, size) -> parsed JSON
+        self._disk_info_cache: Dict[Tuple[str, int, int], Dict[str, Any]] = {}
+        # directory listing cache: dir -> (mtime_ns, [(name, is_file, size)])
+        self._dir_cache: Dict[str, Tuple[int, List[Tuple[str, bool, int]]]] = {}
+
+    def _cached_stat(self, path: str) -> Optional[os.stat_result]:
+        """stat() with a cache invalidated by the parent directory's mtime."""
+        try:
+            parent_mtime = os.stat(os.path.dirname(path)).st_mtime_ns
+        except OSError:
+            self._stat_cache.pop(path, None)
+            return None
+
+        cached = self._stat_cache.get(path)
+        if cached is not None and cached[0] == parent_mtime:
+            return cached[1]
+
+        try:
+            st: Optional[os.stat_result] = os.stat(path)
+        except OSError:
+            st = None
+        self._stat_cache[path] = (parent_mtime, st)
+        return st
+
     # --- Input Device Management ---
     def get_input_config(self) -> Tuple[str, str]:
         """Return configured (keyboard, mouse) device types."""
@@ -376,16 +622,19 @@ class Session:
         """Interactive menu to manage input device types."""
         KEYBOARD_TYPES: List[str] = ["ps2", "usb", "virtio"]
         MOUSE_TYPES: List[str] = ["ps2", "usb", "usb-tablet", "virtio-tablet"]
+        redraw = True
         while True:
-            UI.clear_screen()
-            print(f"{Colors.CYAN}--- 输入设备配置 ---{Colors.ENDC}")
-            kb, mouse = self.get_input_config()
-            print(f"当前键盘类型: {Colors.GREEN}{kb}{Colors.ENDC}")
-            print(f"当前鼠标类型: {Colors.GREEN}{mouse}{Colors.ENDC}")
-            print("-" * 40)
-            print("  [K] 切换键盘类型")
-            print("  [M] 切换鼠标类型")
-            print("  [B] 返回")
+            if redraw:
+                UI.clear_screen()
+                print(f"{Colors.CYAN}--- 输入设备配置 ---{Colors.ENDC}")
+                kb, mouse = self.get_input_config()
+                print(f"当前键盘类型: {Colors.GREEN}{kb}{Colors.ENDC}")
+                print(f"当前鼠标类型: {Colors.GREEN}{mouse}{Colors.ENDC}")
+                print("-" * 40)
+                print("  [K] 切换键盘类型")
+                print("  [M] 切换鼠标类型")
+                print("  [B] 返回")
+            redraw = True
             choice: str = input("请选择: ").strip().lower()
             if choice == 'b':
                 break
@@ -403,11 +652,22 @@ class Session:
                     idx = 0
                 idx = (idx + 1) % len(MOUSE_TYPES)
                 self.set_input_config(kb, MOUSE_TYPES[idx])
+            else:
+                redraw = False  # nothing changed; just reprint the prompt
+
+    # --- Boot Disk ---
+    @property
+    def boot_disk(self) -> Optional[str]:
+        """Name of the disk that gets a bootindex (defaults to the first)."""
+        configured = self.config.get("BOOT_DISK")
+        if configured in self.disks:
+            return configured
+        return self.disks[0] if self.disks else None
 
     # --- Lifecycle & Config ---
 
     def exists(self) -> bool:
-        return os.path.exists(self.config_file)
+        return self._cached_stat(self.config_file) is not None
 
     def create_structure(self) -> None:
         """Creates the directory structure for the session."""
@@ -427,23 +687,38 @@ class Session:
         iso_map: Dict[int, str] = {}
         
         try:
-            with open(self.config_file, 'r') as f:
-                for line in f:
-                    if '=' in line:
-                        key, val = line.strip().split('=', 1)
-                        val = val.strip('"').strip("'")
-                        
-                        if key.startswith("DISK_"):
-                            try: idx = int(key.split("_")[1])
-                            except: continue
-                            disk_map[idx] = val
-                        elif key.startswith("ISO_"):
-                            try: idx = int(key.split("_")[1])
-                            except: continue
-                            iso_map[idx] = val
-                        else:
-                            self.config[key] = val
-                            
+            # Map the file and split once: no read() copy through a Python
+            # buffer, and MAP_POPULATE prefaults the pages where available.
+            with open(self.config_file, 'rb') as f:
+                try:
+                    flags = mmap.MAP_PRIVATE | getattr(mmap, 'MAP_POPULATE', 0)
+                    mm = mmap.mmap(f.fileno(), 0, prot=mmap.PROT_READ, flags=flags)
+                    data = bytes(mm)
+                    mm.close()
+                except ValueError:  # empty file can't be mapped
+                    data = f.read()
+
+            for raw_line in data.splitlines():
+                line = raw_line.decode('utf-8', 'replace')
+                # partition() scans the line once; split+membership did two.
+                key, sep, val = line.rstrip().partition('=')
+                if not sep:
+                    continue
+                # Unquote with one slice instead of two strip() copies.
+                if val and val[0] in ('"', "'") and val[-1] == val[0]:
+                    val = val[1:-1]
+
+                # Fixed-length slice comparisons dispatch faster than
+                # startswith calls, and int(key[n:]) skips the split.
+                if key[:5] == "DISK_":
+                    try: disk_map[int(key[5:])] = val
+                    except ValueError: continue
+                elif key[:4] == "ISO_":
+                    try: iso_map[int(key[4:])] = val
+                    except ValueError: continue
+                else:
+                    self.config[key] = val
+
             self.disks = [disk_map[i] for i in sorted(disk_map.keys())]
             self.isos = [iso_map[i] for i in sorted(iso_map.keys())]
             return True
@@ -452,20 +727,32 @@ class Session:
             return False
 
     def save(self) -> None:
-        """Saves configuration to disk using atomic write pattern."""
+        """Marks the configuration dirty and flushes it to disk."""
+        self._dirty = True
+        self.flush()
+
+    def flush(self) -> None:
+        """Writes the configuration to disk (atomic write) if it changed."""
+        if not self._dirty:
+            return
         self.create_structure()
         tmp_file = self.config_file + ".tmp"
         try:
-            with open(tmp_file, 'w') as f:
-                for key, val in self.config.items():
-                    f.write(f'{key}="{val}"\n')
-                for i, disk in enumerate(self.disks):
-                    f.write(f'DISK_{i}="{disk}"\n')
-                for i, iso in enumerate(self.isos):
-                    f.write(f'ISO_{i}="{iso}"\n')
-            
-            # Atomic replacement
+            # One write of the joined payload instead of a write per line.
+            parts = [f'{key}="{val}"\n' for key, val in self.config.items()]
+            parts += [f'DISK_{i}="{disk}"\n' for i, disk in enumerate(self.disks)]
+            parts += [f'ISO_{i}="{iso}"\n' for i, iso in enumerate(self.isos)]
+
+            # Raw fd write (no TextIOWrapper buffering) + fsync, then atomic
+            # rename: the replace never publishes a torn or unsynced file.
+            fd = os.open(tmp_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+            try:
+                os.write(fd, ''.join(parts).encode())
+                os.fsync(fd)
+            finally:
+                os.close(fd)
             os.replace(tmp_file, self.config_file)
+            self._dirty = False
         except Exception as e:
             print(f"{Colors.FAIL}保存配置失败: {e}{Colors.ENDC}")
             if os.path.exists(tmp_file):
@@ -473,8 +760,7 @@ class Session:
 
     def delete(self) -> None:
         """Deletes the entire session directory."""
-        if os.path.exists(self.dir):
-            shutil.rmtree(self.dir)
+        shutil.rmtree(self.dir, ignore_errors=True)
 
     def configure_basic(self, is_new: bool = False) -> None:
         """Interactive basic hardware configuration."""
@@ -583,7 +869,16 @@ class Session:
         # 3. Perform Copy
         print(f"{Colors.GREEN}>> 正在导入 {res_type_name} (复制中...)...{Colors.ENDC}")
         try:
-            shutil.copy2(src_path, dest_path)
+            # Hint sequential read-ahead, then copyfile takes the in-kernel
+            # sendfile/copy_file_range fast path (no userspace bounce buffer).
+            if hasattr(os, 'posix_fadvise'):
+                fd = os.open(src_path, os.O_RDONLY)
+                try:
+                    os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+                finally:
+                    os.close(fd)
+            shutil.copyfile(src_path, dest_path)
+            shutil.copystat(src_path, dest_path)
             print(f"{Colors.GREEN}>> 导入成功。{Colors.ENDC}")
             return filename
         except Exception as e:
@@ -593,56 +888,81 @@ class Session:
 
     def file_manager(self, target_dir: str, file_type_desc: str) -> None:
         """Interactive file manager for physical file deletion."""
+        redraw = True
         while True:
-            UI.clear_screen()
-            print(f"{Colors.CYAN}--- {file_type_desc}文件清理 ---{Colors.ENDC}")
-            print(f"目录: {target_dir}")
-            print("此处列出存档目录下的所有物理文件。")
-            print("-" * 40)
-            
-            if not os.path.exists(target_dir):
-                print("  (目录不存在)")
-                files = []
-            else:
-                files = sorted(os.listdir(target_dir))
+            if redraw:
+                UI.clear_screen()
+                print(f"{Colors.CYAN}--- {file_type_desc}文件清理 ---{Colors.ENDC}")
+                print(f"目录: {target_dir}")
+                print("此处列出存档目录下的所有物理文件。")
+                print("-" * 40)
             
-            if not files:
-                print("  (目录为空)")
-            else:
-                for i, f in enumerate(files):
-                    path = os.path.join(target_dir, f)
-                    if os.path.isfile(path):
-                        size = os.path.getsize(path)
-                        size_str = f"{size / 1024 / 1024:.1f} MB"
-                    else:
-                        size_str = "DIR"
-
-                    # Check usage status
-                    status = ""
-                    if target_dir == self.disk_dir:
-                        # 1. 当前配置直接引用
-                        if f in self.disks:
-                            status = f"{Colors.GREEN}*[使用中]*{Colors.ENDC}"
+                # Listing cache keyed on the directory mtime: redraws that change
+                # nothing (invalid input, back-and-forth) reuse the previous scan.
+                try:
+                    dir_mtime: Optional[int] = os.stat(target_dir).st_mtime_ns
+                except FileNotFoundError:
+                    print("  (目录不存在)")
+                    dir_mtime = None
+
+                cached_listing = self._dir_cache.get(target_dir)
+                if dir_mtime is None:
+                    listing: List[Tuple[str, bool, int]] = []
+                elif cached_listing is not None and cached_listing[0] == dir_mtime:
+                    listing = cached_listing[1]
+                else:
+                    # One scandir: entry type and size come from the DirEntry
+                    # cache instead of separate isfile/getsize stats per file.
+                    with os.scandir(target_dir) as it:
+                        listing = sorted(
+                            (e.name, e.is_file(follow_symlinks=False),
+                             e.stat().st_size if e.is_file(follow_symlinks=False) else 0)
+                            for e in it)
+                    self._dir_cache[target_dir] = (dir_mtime, listing)
+                files = [name for name, _, _ in listing]
+
+                if not files:
+                    if dir_mtime is not None:
+                        print("  (目录为空)")
+                else:
+                    for i, (f, is_file, size) in enumerate(listing):
+                        if is_file:
+                            # Integer-only x.y MB: (size*10)>>20 is tenths of a MB.
+                            mb10 = (size * 10) >> 20
+                            size_str = f"{mb10 // 10}.{mb10 % 10} MB"
                         else:
-                            # 2. 被快照引用（作为 backing file）
-                            for disk in self.disks:
-                                info = self.get_disk_info(disk)
-                                if info and 'backing-filename' in info:
-                                    backing = os.path.basename(info['backing-filename'])
-                                    if backing == f:
-                                        status = f"{Colors.GREEN}*[被快照引用]*{Colors.ENDC}"
-                                        break
-                    elif target_dir == self.iso_dir:
-                        if f in self.isos:
-                            status = f"{Colors.GREEN}*[使用中]*{Colors.ENDC}"
-                    print(f"  [{i+1}] {f} ({size_str}) {status}")
+                            size_str = "DIR"
+
+                        # Check usage status
+                        status = ""
+                        if target_dir == self.disk_dir:
+                            # 1. 当前配置直接引用
+                            if f in self.disks:
+                                status = f"{Colors.GREEN}*[使用中]*{Colors.ENDC}"
+                            else:
+                                # 2. 被快照引用（作为 backing file）
+                                for disk in self.disks:
+                                    info = self.get_disk_info(disk)
+                                    if info and 'backing-filename' in info:
+                                        backing = os.path.basename(info['backing-filename'])
+                                        if backing == f:
+                                            status = f"{Colors.GREEN}*[被快照引用]*{Colors.ENDC}"
+                                            break
+                        elif target_dir == self.iso_dir:
+                            if f in self.isos:
+                                status = f"{Colors.GREEN}*[使用中]*{Colors.ENDC}"
+                        print(f"  [{i+1}] {f} ({size_str}) {status}")
             
-            print("-" * 40)
-            print("  [D] 删除文件 (Delete)")
-            print("  [B] 返回 (Back)")
+                print("-" * 40)
+                print("  [D] 删除文件 (Delete)")
+                print("  [B] 返回 (Back)")
             
+            redraw = True
             choice = input("请选择: ").strip().lower()
-            if choice == 'b': break
+            if choice == 'b':
+                # Deletes only mark the config dirty; one write on exit.
+                self.flush()
+                break
             elif choice == 'd':
                 idx_str = UI.get_input("请输入要删除的文件序号", "")
                 if idx_str.isdigit():
@@ -667,6 +987,8 @@ class Session:
                                     shutil.rmtree(fpath)
                                 else:
                                     os.remove(fpath)
+                                self._stat_cache.pop(fpath, None)
+                                self._dir_cache.pop(target_dir, None)
                                 print(f"{Colors.GREEN}>> 文件已删除。{Colors.ENDC}")
                                 
                                 # Remove from config if used
@@ -675,50 +997,70 @@ class Session:
                                         self.disks.remove(fname)
                                     elif target_dir == self.iso_dir:
                                         self.isos.remove(fname)
-                                    self.save()
+                                    self._dirty = True
                                     print(f"{Colors.GREEN}>> 已自动从配置中卸载。{Colors.ENDC}")
                             except Exception as e:
                                 print(f"{Colors.FAIL}>> 删除失败: {e}{Colors.ENDC}")
                             time.sleep(1)
+            else:
+                redraw = False  # nothing changed; just reprint the prompt
 
     # --- Disk Operations ---
 
     def get_disk_info(self, disk_name: str) -> Optional[Dict[str, Any]]:
-        """Retrieves QEMU disk info as JSON."""
+        """Retrieves QEMU disk info as JSON (cached by path/mtime/size)."""
         path = os.path.join(self.disk_dir, disk_name)
-        if not os.path.exists(path): return None
         try:
-            res = subprocess.run(["qemu-img", "info", "--output=json", path], 
-                                 capture_output=True, text=True, check=True)
-            return json.loads(res.stdout)
+            st = os.stat(path)
+        except OSError:
+            return None
+
+        # A cheap stat keys the cache; any write to the image changes the key,
+        # so menu redraws don't fork a qemu-img per disk.
+        key = (path, st.st_mtime_ns, st.st_size)
+        info = self._disk_info_cache.get(key)
+        if info is not None:
+            return info
+
+        try:
+            res = subprocess.run(["qemu-img", "info", "--output=json", path],
+                                 capture_output=True, check=True)
+            info = json.loads(res.stdout.decode())
         except:
             return None
+        self._disk_info_cache[key] = info
+        return info
+
+    def _invalidate_disk_info(self, disk_name: str) -> None:
+        """Drops cached qemu-img info for a disk after a mutating operation."""
+        path = os.path.join(self.disk_dir, disk_name)
+        for key in [k for k in self._disk_info_cache if k[0] == path]:
+            del self._disk_info_cache[key]
 
     def manage_disk(self) -> None:
         """Interactive Disk Management Menu."""
+        redraw = True
         while True:
-            UI.clear_screen()
-            print(f"{Colors.CYAN}--- 磁盘管理 ---{Colors.ENDC}")
-            if not self.disks:
-                print("  (无磁盘)")
-            else:
-                for i, disk in enumerate(self.disks):
-                    info = self.get_disk_info(disk)
-                    status = ""
-                    if info and 'backing-filename' in info:
-                        status = f"{Colors.CYAN}[快照]{Colors.ENDC}"
-                    else:
-                        status = f"{Colors.BLUE}[基础]{Colors.ENDC}"
-                    print(f"  [{i+1}] {disk} {status}")
-            
-            print("-" * 40)
-            print("  [A] 添加新磁盘 (Add/Create)")
-            print("  [I] 导入磁盘 (Import)")
-            print("  [S] 快照管理 (Snapshots)")
-            print("  [D] 卸载磁盘 (Detach)")
-            print("  [F] 文件清理 (File Manager)")
-            print("  [B] 返回 (Back)")
-            
+            if redraw:
+                UI.clear_screen()
+                print(f"{Colors.CYAN}--- 磁盘管理 ---{Colors.ENDC}")
+                if not self.disks:
+                    print("  (无磁盘)")
+                else:
+                    for i, disk in enumerate(self.disks):
+                        info = self.get_disk_info(disk)
+                        status = ""
+                        if info and 'backing-filename' in info:
+                            status = f"{Colors.CYAN}[快照]{Colors.ENDC}"
+                        else:
+                            status = f"{Colors.BLUE}[基础]{Colors.ENDC}"
+                        if disk == self.boot_disk:
+                            status += f" {Colors.GREEN}[启动盘]{Colors.ENDC}"
+                        print(f"  [{i+1}] {disk} {status}")
+
+                sys.stdout.write(DISK_MENU)
+            redraw = True
+
             choice = input("请选择: ").strip().lower()
             
             if choice == 'b': break
@@ -738,16 +1080,30 @@ class Session:
                     
                 print(f"{Colors.GREEN}>> 创建磁盘镜像...{Colors.ENDC}")
                 try:
-                    subprocess.run(["qemu-img", "create", "-f", "qcow2", dest_path, size], check=True)
-                    if os.path.exists(dest_path):
-                        self.disks.append(name)
-                        self.save()
-                    else:
-                        raise Exception("文件创建后未找到")
-                except Exception as e:
+                    proc = subprocess.run(["qemu-img", "create", "-f", "qcow2", dest_path, size],
+                                          capture_output=True)
+                except OSError as e:  # qemu-img missing
                     print(f"{Colors.FAIL}>> 创建失败: {e}{Colors.ENDC}")
                     time.sleep(1)
+                    continue
+                if proc.returncode == 0 and os.path.exists(dest_path):
+                    self.disks.append(name)
+                    self.save()
+                else:
+                    err = proc.stderr.decode(errors='replace').strip() or "文件创建后未找到"
+                    print(f"{Colors.FAIL}>> 创建失败: {err}{Colors.ENDC}")
+                    time.sleep(1)
                 
+            elif choice == 't':
+                idx_str = UI.get_input("请输入要设为启动盘的磁盘序号", "")
+                if idx_str.isdigit():
+                    idx = int(idx_str) - 1
+                    if 0 <= idx < len(self.disks):
+                        self.config["BOOT_DISK"] = self.disks[idx]
+                        self.save()
+                        print(f"{Colors.GREEN}>> 启动盘已设置: {self.disks[idx]}{Colors.ENDC}")
+                        time.sleep(1)
+
             elif choice == 'i':
                 path = UI.get_input("请输入源磁盘文件路径", "")
                 imported_name = self.import_resource(path, self.disk_dir, "磁盘镜像")
@@ -767,50 +1123,74 @@ class Session:
                             self.save()
                             print(">> 磁盘已卸载。")
 
+            else:
+                redraw = False  # nothing changed; just reprint the prompt
+
     def manage_snapshots(self) -> None:
         """Interactive Snapshot Management Menu."""
+        # Info survives across redraws; only the disk an operation touched
+        # is re-queried.
+        disk_infos: Dict[int, Optional[Dict[str, Any]]] = {}
+        stale = True
+        redraw = True
         while True:
-            UI.clear_screen()
-            print(f"{Colors.CYAN}--- 快照/覆盖层管理 (Snapshot/Overlay) ---{Colors.ENDC}")
-            print("利用 QEMU 的 backing file 机制实现高性能快照。")
-            print("基础镜像 (Base) -> 只读，作为模板")
-            print("覆盖层 (Overlay) -> 读写，存储差异数据")
-            print("-" * 40)
-            
-            if not self.disks:
-                print("  (无磁盘)")
-                time.sleep(1)
-                break
+            if redraw:
+                UI.clear_screen()
+                print(f"{Colors.CYAN}--- 快照/覆盖层管理 (Snapshot/Overlay) ---{Colors.ENDC}")
+                print("利用 QEMU 的 backing file 机制实现高性能快照。")
+                print("基础镜像 (Base) -> 只读，作为模板")
+                print("覆盖层 (Overlay) -> 读写，存储差异数据")
+                print("-" * 40)
+
+                if not self.disks:
+                    print("  (无磁盘)")
+                    time.sleep(1)
+                    break
 
-            disk_infos: Dict[int, Optional[Dict[str, Any]]] = {}
-            for i, disk in enumerate(self.disks):
-                info = self.get_disk_info(disk)
-                disk_infos[i] = info
-                
-                status = f"{Colors.GREEN}[基础镜像]{Colors.ENDC}"
-                if info and 'backing-filename' in info:
-                    backing = os.path.basename(info['backing-filename'])
-                    status = f"{Colors.CYAN}[快照模式]{Colors.ENDC} -> {backing}"
-                
-                print(f"  [{i+1}] {disk}  {status}")
+                if stale:
+                    # Fork-bound qemu-img queries run concurrently: wall time is
+                    # ~max(latency) instead of N×latency (cache hits are free).
+                    with ThreadPoolExecutor(max_workers=min(8, len(self.disks))) as ex:
+                        disk_infos = dict(enumerate(ex.map(self.get_disk_info, self.disks)))
+                    stale = False
+
+                for i, disk in enumerate(self.disks):
+                    info = disk_infos[i]
+
+                    status = f"{Colors.GREEN}[基础镜像]{Colors.ENDC}"
+                    if info and 'backing-filename' in info:
+                        backing = os.path.basename(info['backing-filename'])
+                        status = f"{Colors.CYAN}[快照模式]{Colors.ENDC} -> {backing}"
+
+                    print(f"  [{i+1}] {disk}  {status}")
+
+                print("-" * 40)
+                print("  [B] 返回 (Back)")
+            redraw = True
 
-            print("-" * 40)
-            print("  [B] 返回 (Back)")
-            
             choice = input("请选择磁盘序号进行操作: ").strip().lower()
             if choice == 'b': break
-            
+
             if choice.isdigit():
                 idx = int(choice) - 1
                 if 0 <= idx < len(self.disks):
-                    self.snapshot_ops(idx, self.disks[idx], disk_infos[idx])
+                    changed = self.snapshot_ops(idx, self.disks[idx], disk_infos[idx])
+                    if changed is not None:
+                        # Refresh only the touched disk; the rest stay valid.
+                        disk_infos[changed] = self.get_disk_info(self.disks[changed])
+            else:
+                redraw = False  # nothing changed; just reprint the prompt
 
-    def snapshot_ops(self, idx: int, disk_name: str, info: Optional[Dict[str, Any]]) -> None:
-        """Operations for a specific disk (Snapshot/Reset/Commit)."""
+    def snapshot_ops(self, idx: int, disk_name: str, info: Optional[Dict[str, Any]]) -> Optional[int]:
+        """
+        Operations for a specific disk (Snapshot/Reset/Commit).
+        Returns the index of the disk if the operation (possibly) changed it,
+        so the caller can refresh just that entry.
+        """
         if not info:
             print(f"{Colors.FAIL}无法获取磁盘信息。{Colors.ENDC}")
             time.sleep(1)
-            return
+            return None
 
         is_overlay = 'backing-filename' in info
         disk_path = os.path.join(self.disk_dir, disk_name)
@@ -833,28 +1213,37 @@ class Session:
                     try:
                         # Atomic-like replacement: Rename old -> Create new -> Delete old
                         os.rename(disk_path, tmp_path)
-                        subprocess.run(["qemu-img", "create", "-f", "qcow2", 
-                                      "-b", backing, "-F", "qcow2", disk_name], 
-                                      cwd=self.disk_dir, check=True)
+                        proc = subprocess.run(["qemu-img", "create", "-f", "qcow2",
+                                             "-b", backing, "-F", "qcow2", disk_name],
+                                             cwd=self.disk_dir, capture_output=True)
+                        if proc.returncode:
+                            raise OSError(proc.stderr.decode(errors='replace').strip())
                         os.remove(tmp_path)
+                        self._invalidate_disk_info(disk_name)
                         print(f"{Colors.GREEN}>> 重置成功。{Colors.ENDC}")
-                    except Exception as e:
+                    except OSError as e:
                         print(f"{Colors.FAIL}>> 操作失败: {e}{Colors.ENDC}")
                         # Try to restore
                         if os.path.exists(tmp_path) and not os.path.exists(disk_path):
                             os.rename(tmp_path, disk_path)
                             print(f"{Colors.WARNING}>> 已恢复原文件。{Colors.ENDC}")
                     time.sleep(1)
-            
+                    return idx
+
             elif op == 'c':
                 print(f"{Colors.WARNING}警告: 这将把快照中的更改永久写入基础镜像。{Colors.ENDC}")
                 if UI.get_input("确认合并? (y/N)", "N").lower() == 'y':
-                    try:
-                        subprocess.run(["qemu-img", "commit", disk_path], check=True)
+                    proc = subprocess.run(["qemu-img", "commit", disk_path],
+                                          capture_output=True)
+                    if proc.returncode:
+                        err = proc.stderr.decode(errors='replace').strip()
+                        print(f"{Colors.FAIL}>> 操作失败: {err}{Colors.ENDC}")
+                    else:
+                        self._invalidate_disk_info(disk_name)
+                        self._invalidate_disk_info(os.path.basename(info['backing-filename']))
                         print(f"{Colors.GREEN}>> 合并成功。{Colors.ENDC}")
-                    except Exception as e:
-                        print(f"{Colors.FAIL}>> 操作失败: {e}{Colors.ENDC}")
                     time.sleep(1)
+                    return idx
 
             elif op == 'd':
                 if UI.get_input(f"{Colors.WARNING}确认丢弃快照并切回基础镜像? (y/N){Colors.ENDC}", "N").lower() == 'y':
@@ -866,10 +1255,12 @@ class Session:
                         self.save()
                         try:
                             os.remove(disk_path)
+                            self._invalidate_disk_info(disk_name)
                             print(f"{Colors.GREEN}>> 快照已删除，已切回基础镜像。{Colors.ENDC}")
                         except:
                             print(f"{Colors.WARNING}>> 配置已更新，但删除文件失败。{Colors.ENDC}")
                     time.sleep(1)
+                    return idx
 
         else:
             print(f"当前状态: {Colors.GREEN}基础镜像 (Base){Colors.ENDC}")
@@ -885,38 +1276,41 @@ class Session:
                 if os.path.exists(overlay_path):
                     print(f"{Colors.FAIL}错误: 目标文件 {overlay_name} 已存在。{Colors.ENDC}")
                 else:
-                    try:
-                        subprocess.run(["qemu-img", "create", "-f", "qcow2", 
-                                      "-b", disk_name, "-F", "qcow2", overlay_name], 
-                                      cwd=self.disk_dir, check=True)
+                    proc = subprocess.run(["qemu-img", "create", "-f", "qcow2",
+                                         "-b", disk_name, "-F", "qcow2", overlay_name],
+                                         cwd=self.disk_dir, capture_output=True)
+                    if proc.returncode:
+                        err = proc.stderr.decode(errors='replace').strip()
+                        print(f"{Colors.FAIL}>> 创建失败: {err}{Colors.ENDC}")
+                    else:
                         self.disks[idx] = overlay_name
                         self.save()
                         print(f"{Colors.GREEN}>> 快照创建成功，已切换到快照模式。{Colors.ENDC}")
-                    except Exception as e:
-                        print(f"{Colors.FAIL}>> 创建失败: {e}{Colors.ENDC}")
                 time.sleep(1)
+                return idx
+
+        return None
 
     # --- ISO & Mount Operations ---
 
     def manage_cdrom(self) -> None:
         """Interactive CDROM/ISO Management Menu."""
+        redraw = True
         while True:
-            UI.clear_screen()
-            print(f"{Colors.CYAN}--- 光驱/ISO 管理 ---{Colors.ENDC}")
-            if not self.isos:
-                print("  (无 ISO)")
-            else:
-                for i, iso in enumerate(self.isos):
-                    print(f"  [{i+1}] {iso}")
-            
-            print("-" * 40)
-            print("  [I] 导入 ISO 文件 (Import ISO)")
-            print("  [D] 弹出/移除 ISO (Detach)")
-            print("  [F] 文件清理 (File Manager)")
-            print("  [B] 返回 (Back)")
-            
+            if redraw:
+                UI.clear_screen()
+                print(f"{Colors.CYAN}--- 光驱/ISO 管理 ---{Colors.ENDC}")
+                if not self.isos:
+                    print("  (无 ISO)")
+                else:
+                    for i, iso in enumerate(self.isos):
+                        print(f"  [{i+1}] {iso}")
+
+                sys.stdout.write(CDROM_MENU)
+            redraw = True
+
             choice = input("请选择: ").strip().lower()
-            
+
             if choice == 'b': break
             elif choice == 'f':
                 self.file_manager(self.iso_dir, "ISO")
@@ -933,25 +1327,24 @@ class Session:
                     if 0 <= idx < len(self.isos):
                         del self.isos[idx]
                         self.save()
+            else:
+                redraw = False  # nothing changed; just reprint the prompt
 
     def manage_extra_mounts(self) -> None:
         """Interactive Extra Mounts (USB/VVFAT) Menu."""
+        redraw = True
         while True:
-            UI.clear_screen()
-            print(f"{Colors.CYAN}--- 更多挂载方式 (USB/VVFAT) ---{Colors.ENDC}")
-            print("此处管理的资源将以 [USB 移动存储设备] 的形式挂载到虚拟机。")
-            print(f"默认共享目录 (VVFAT/只读/500MB限制): {Colors.BLUE}{self.shared_dir}{Colors.ENDC}")
-            print(f"临时挂载点数: {len(self.transient_mounts)}")
-            print("-" * 40)
-            print("  [I] 导入文件到默认共享目录 (Import to Default)")
-            print("  [F] 管理默认共享目录文件 (File Manager)")
-            print("  [A] 添加临时挂载 (Add Transient Mount)")
-            print("  [C] 清空临时挂载 (Clear Transient)")
-            print("  [O] 打开默认共享目录 (Open Default Folder)")
-            print("  [B] 返回 (Back)")
-            
+            if redraw:
+                UI.clear_screen()
+                print(f"{Colors.CYAN}--- 更多挂载方式 (9p/USB) ---{Colors.ENDC}")
+                print("目录以 [virtio-9p] 共享 (标签 shared/transN)，镜像文件以 [USB 移动存储设备] 挂载。")
+                print(f"默认共享目录 (9p/只读): {Colors.BLUE}{self.shared_dir}{Colors.ENDC}")
+                print(f"临时挂载点数: {len(self.transient_mounts)}")
+                sys.stdout.write(MOUNTS_MENU)
+            redraw = True
+
             choice = input("请选择: ").strip().lower()
-            
+
             if choice == 'b': break
             elif choice == 'f':
                 self.file_manager(self.shared_dir, "共享")
@@ -970,7 +1363,7 @@ class Session:
                 else:
                     self.transient_mounts.append(resolved_path)
                     if os.path.isdir(resolved_path):
-                        print(f"{Colors.GREEN}>> 已添加目录 (VVFAT模式): {resolved_path}{Colors.ENDC}")
+                        print(f"{Colors.GREEN}>> 已添加目录 (9p模式): {resolved_path}{Colors.ENDC}")
                     else:
                         print(f"{Colors.GREEN}>> 已添加文件 (Raw模式): {resolved_path}{Colors.ENDC}")
                 time.sleep(1)
@@ -986,6 +1379,9 @@ class Session:
                 print(">> 已尝试打开目录。")
                 time.sleep(1)
 
+            else:
+                redraw = False  # nothing changed; just reprint the prompt
+
 # ==============================================================================
 # MODULE: MAIN ENTRY POINT
 # ==============================================================================
@@ -998,29 +1394,23 @@ def session_loop(session_name: str, ovmf_code: str, ovmf_vars_template: str) ->
         time.sleep(1)
         return
 
+    redraw = True
     while True:
-        UI.clear_screen()
-        UI.print_header()
-        print(f"当前会话: {Colors.GREEN}{session.name}{Colors.ENDC}")
-        print(f"配置概览: {session.config.get('CPU_CORES')} Cores / {session.config.get('MEM_SIZE')} RAM")
-        print(f"磁盘数量: {len(session.disks)}")
-        print(f"ISO 数量: {len(session.isos)}")
-        
-        if session.transient_mounts:
-            print(f"\n{Colors.CYAN}临时挂载:{Colors.ENDC}")
-            for p in session.transient_mounts:
-                print(f"  + {p}")
-
-        print("-" * 52)
-        print("  [S] 启动虚拟机 (Start)")
-        print("  [H] CPU和内存配置 (CPU/Mem)")
-        print("  [I] 输入配置 (Input)")
-        print("  [D] 磁盘管理 (Disks)")
-        print("  [C] 光驱管理 (CD/ISO)")
-        print("  [M] 更多挂载 (Mounts)")
-        print("  [X] 删除会话 (Delete Session)")
-        print("  [B] 返回主菜单 (Back)")
-        print("-" * 52)
+        if redraw:
+            UI.clear_screen()
+            UI.print_header()
+            print(f"当前会话: {Colors.GREEN}{session.name}{Colors.ENDC}")
+            print(f"配置概览: {session.config.get('CPU_CORES')} Cores / {session.config.get('MEM_SIZE')} RAM")
+            print(f"磁盘数量: {len(session.disks)}")
+            print(f"ISO 数量: {len(session.isos)}")
+
+            if session.transient_mounts:
+                print(f"\n{Colors.CYAN}临时挂载:{Colors.ENDC}")
+                for p in session.transient_mounts:
+                    print(f"  + {p}")
+
+            sys.stdout.write(SESSION_MENU)
+        redraw = True
 
         choice = input("请选择: ").strip().lower()
 
@@ -1048,6 +1438,8 @@ def session_loop(session_name: str, ovmf_code: str, ovmf_vars_template: str) ->
                 print("会话已删除。")
                 time.sleep(1)
                 break
+        else:
+            redraw = False  # nothing changed; just reprint the prompt
 
 def main() -> None:
     """Application entry point."""
@@ -1060,33 +1452,31 @@ def main() -> None:
         print("请安装 ovmf (Debian/Ubuntu) 或 edk2-ovmf (Fedora/Arch)。")
         sys.exit(1)
 
+    redraw = True
     while True:
-        UI.clear_screen()
-        UI.print_header()
-        print(f"存档位置: {SAVE_ROOT}")
-        
-        # 2. Scan Sessions
-        sessions: List[str] = []
-        if os.path.exists(SAVE_ROOT):
-            for d in os.listdir(SAVE_ROOT):
-                if os.path.isdir(os.path.join(SAVE_ROOT, d)):
-                    sessions.append(d)
-        sessions.sort()
-        
-        print(f"{Colors.BLUE}现有会话:{Colors.ENDC}")
-        if not sessions:
-            print("  (无)")
-        else:
-            for i, name in enumerate(sessions):
-                print(f"  [{i+1}] {name}")
-        
-        print("-" * 52)
-        print("  [N] 新建会话 (New Session)")
-        print("  [Q] 退出 (Quit)")
-        print("-" * 52)
-        
+        if redraw:
+            UI.clear_screen()
+            UI.print_header()
+            print(f"存档位置: {SAVE_ROOT}")
+
+            # 2. Scan Sessions (one scandir, dir check via cached d_type)
+            try:
+                sessions: List[str] = sorted(e.name for e in os.scandir(SAVE_ROOT) if e.is_dir())
+            except FileNotFoundError:
+                sessions = []
+
+            print(f"{Colors.BLUE}现有会话:{Colors.ENDC}")
+            if not sessions:
+                print("  (无)")
+            else:
+                for i, name in enumerate(sessions):
+                    print(f"  [{i+1}] {name}")
+
+            sys.stdout.write(MAIN_MENU)
+        redraw = True
+
         choice = input("请选择: ").strip().lower()
-        
+
         if choice == 'q':
             sys.exit(0)
         elif choice == 'n':
@@ -1109,6 +1499,8 @@ def main() -> None:
             else:
                 print("无效选择")
                 time.sleep(0.5)
+        else:
+            redraw = False  # nothing changed; just reprint the prompt
 
 if __name__ == "__main__":
     main()